@@ -1,4 +1,5 @@
 from goatools import obo_parser
+import functools
 import os
 import logging
 
@@ -242,3 +243,18 @@ class GeneOntologyDb:
             return anc_ids
         else:
             return set()
+
+
+@functools.lru_cache(maxsize=4)
+def get_go_db(data_dir, slim_down=False):
+    """
+    load a GeneOntologyDb for data_dir, reusing a previously loaded copy when
+    the same directory and slim setting are requested again in this process.
+    the database is read-only, so repeated analyses can safely share one
+    instance
+
+    :param data_dir: directory that contains the database files
+    :param slim_down: whether slim will be used in the analysis
+    :return: a GeneOntologyDb object
+    """
+    return GeneOntologyDb(data_dir, slim_down)
@@ -1,6 +1,8 @@
 from ete3 import NCBITaxa
+import functools
 import os
 import numpy as np
+from numba import njit
 import logging
 import warnings
 
@@ -41,6 +43,41 @@ UNKNOWN_RANK = 'unknown'
 UNIDENTIFIED = 32644
 
 
+@njit(cache=True)
+def _walk_to_rank(taxids, target_rank_num, parents, rank_nums):
+    """
+    walk up the taxonomy tree from each query taxid until a node with the
+    target rank is found. compiled with numba, so the per-node steps are
+    plain integer array reads rather than database queries
+
+    :param taxids: 1-D int64 array of query taxids
+    :param target_rank_num: numeric target rank (see NUMERIC_RANK)
+    :param parents: int32 array mapping taxid -> parent taxid
+    :param rank_nums: int8 array mapping taxid -> numeric rank
+    :return: int64 array with the taxid at the target rank for each query.
+    0 where the target rank is below the query rank, UNIDENTIFIED where the
+    target rank is missing from the lineage
+    """
+    out = np.zeros(taxids.size, dtype=np.int64)
+    for i in range(taxids.size):
+        query = taxids[i]
+        # target ranks lower in the hierarchy than the query cannot be mapped
+        if target_rank_num > rank_nums[query]:
+            continue
+        mapped = UNIDENTIFIED
+        cur = query
+        while True:
+            if rank_nums[cur] == target_rank_num:
+                mapped = cur
+                break
+            parent = parents[cur]
+            if parent == cur or parent <= 0:
+                break
+            cur = parent
+        out[i] = mapped
+    return out
+
+
 class NCBITaxonomyDb:
     def __init__(self, data_dir):
         """
@@ -49,6 +86,9 @@ class NCBITaxonomyDb:
         :param data_dir: Data directory
         """
         self.ncbi = self._load_ncbi_db(data_dir)
+        # flat tree arrays for compiled walks, built on first use
+        self._parents = None
+        self._rank_nums = None
 
     @staticmethod
     def _define_tax_paths(data_dir):
@@ -146,6 +186,45 @@ class NCBITaxonomyDb:
                     rt_dict[rank] = UNIDENTIFIED
         return rt_dict
 
+    def _load_tree_arrays(self):
+        """
+        lazily build flat parent and rank arrays indexed by taxid, so tree
+        walks can run in compiled code instead of issuing per-node database
+        queries. ~15 MB for the current NCBI taxonomy
+
+        :return: None
+        """
+        if self._parents is not None:
+            return
+        rows = self.ncbi.db.execute('SELECT taxid, parent, rank FROM species').fetchall()
+        max_taxid = max(row[0] for row in rows)
+        parents = np.zeros(max_taxid + 1, dtype=np.int32)
+        rank_nums = np.zeros(max_taxid + 1, dtype=np.int8)
+        for taxid, parent, rank in rows:
+            parents[taxid] = parent
+            # ranks outside FULL_TAXONOMY_TREE are treated as 'no rank'
+            rank_nums[taxid] = NUMERIC_RANK.get(rank, 0)
+        self._parents = parents
+        self._rank_nums = rank_nums
+
+    def map_ids_to_desired_rank(self, taxids, des_rank):
+        """
+        map many taxids to the taxid of a single desired rank, walking the
+        taxonomy tree in compiled code. bulk counterpart of
+        map_id_to_desired_ranks for one rank
+
+        :param taxids: a list, array, or other collection of taxids. all must
+        be present in the database (see is_in_db)
+        :param des_rank: the desired rank
+        :return: dictionary of the form {taxid: mapped taxid, ...}. the mapped
+        taxid is 0 if des_rank is below the taxid's own rank, and UNIDENTIFIED
+        if des_rank is missing from the taxid's lineage
+        """
+        self._load_tree_arrays()
+        id_arr = np.fromiter((int(taxid) for taxid in taxids), dtype=np.int64)
+        mapped = _walk_to_rank(id_arr, NUMERIC_RANK[des_rank], self._parents, self._rank_nums)
+        return {int(taxid): int(m) for taxid, m in zip(id_arr, mapped)}
+
     def expand_sample_taxonomy(self, sample_set):
         """
         Expand sample set to include ancestors
@@ -185,6 +264,16 @@ class NCBITaxonomyDb:
         query_rank = self.ncbi.get_rank([taxid])[taxid]
         return query_rank
 
+    def get_ranks_bulk(self, taxids):
+        """
+        get the ranks of multiple taxids with a single database query
+
+        :param taxids: a list, array, or other collection of taxids
+        :return: dictionary of the form {taxid: rank, ...}. taxids that are
+        not in the database are omitted
+        """
+        return self.ncbi.get_rank([int(taxid) for taxid in taxids])
+
     def get_children(self, taxid):
         """
         get all children of the query taxid
@@ -302,3 +391,16 @@ class NCBITaxonomyDb:
             else:
                 ids[i] = np.nan  # make missing, will be filtered out later
         return ids
+
+
+@functools.lru_cache(maxsize=4)
+def get_ncbi_db(data_dir):
+    """
+    load an NCBITaxonomyDb for data_dir, reusing a previously loaded copy
+    when the same directory is requested again in this process. the database
+    is read-only, so repeated analyses can safely share one instance
+
+    :param data_dir: directory that contains NCBI database files
+    :return: an NCBITaxonomyDb object
+    """
+    return NCBITaxonomyDb(data_dir)
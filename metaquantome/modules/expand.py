@@ -92,12 +92,15 @@ def common_hierarchical_analysis(db, df, annot_colname, samp_grps, hierarchical=
     int_w_means = calc_means(intensity_all_ranks, samp_grps)
     # todo: calculate sds
 
-    # clean and log transform
-    # replace nan with zero, so that np.log2 returns nan
-    int_w_means[int_w_means == 0] = np.nan
-
-    # take log of intensities for return
-    int_w_means[samp_grps.all_intcols] = np.log2(int_w_means[samp_grps.all_intcols])
+    # clean and log transform. one fused pass writes the log2 of positive
+    # intensities and NaN elsewhere, rather than masking zeros to NaN first
+    arr = int_w_means[samp_grps.all_intcols].to_numpy(dtype=np.float64)
+    logged = np.full_like(arr, np.nan)
+    np.log2(arr, out=logged, where=arr > 0)
+    int_w_means[samp_grps.all_intcols] = logged
+    # zeros in the remaining columns (means, counts) are also missing
+    other_cols = [col for col in int_w_means.columns if col not in samp_grps.all_intcols]
+    int_w_means[other_cols] = int_w_means[other_cols].where(int_w_means[other_cols] != 0)
 
     # define an "id" column using the index
     int_w_means['id'] = int_w_means.index
@@ -116,9 +119,10 @@ def calc_means(df, samp_grps):
         samples_in_grp = samp_grps.sample_names[grp_name]
         if len(samples_in_grp) > 1:
             sample = df[samples_in_grp]
-            means = np.mean(sample, axis=1)
-            means[means == 0] = np.nan
-            logs = np.log2(means)
+            means = np.mean(sample, axis=1).to_numpy()
+            # log2 of the positive means and NaN elsewhere, in one pass
+            logs = np.full_like(means, np.nan)
+            np.log2(means, out=logs, where=means > 0)
             df[samp_grps.mean_names[i]] = logs
 
         else:
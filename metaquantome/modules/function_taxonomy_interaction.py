@@ -1,9 +1,11 @@
 import numpy as np
+import pandas as pd
+from numba import njit, prange
 
 import metaquantome.modules.expand
 from metaquantome.util import utils
 from metaquantome.modules import functional_analysis as fa
-from metaquantome.databases.NCBITaxonomyDb import NCBITaxonomyDb
+from metaquantome.databases.NCBITaxonomyDb import get_ncbi_db
 
 
 def function_taxonomy_analysis(df, func_colname, pep_colname, ontology, slim_down, tax_colname, samp_grps, ft_tar_rank,
@@ -43,79 +45,131 @@ def function_taxonomy_analysis(df, func_colname, pep_colname, ontology, slim_dow
         norm_df = fa.slim_down_df(godb, norm_df, func_colname)
     # remove peptide/go-term duplicates (in the case that different GO term annotations
     # for the same peptide are mapped to the same slim GO term)
-    # index is named peptide
-    dedup_df = norm_df.\
-        reset_index().\
-        drop_duplicates(subset=['peptide', func_colname], keep='first').\
-        set_index('peptide')
+    # index is named peptide. factorize the peptide index and the GO terms to
+    # integer codes, pack each pair into one int64 composite key, and keep the
+    # first occurrence of each key. this avoids the reset_index/set_index
+    # round trip and the per-row string-pair hashing of drop_duplicates
+    pep_codes, _ = pd.factorize(norm_df.index)
+    go_codes, _ = pd.factorize(norm_df[func_colname])
+    pep_go_key = pep_codes.astype(np.int64) << 32 | go_codes
+    _, first_idx = np.unique(pep_go_key, return_index=True)
+    dedup_df = norm_df.iloc[np.sort(first_idx)]
     # ---- get rank of lca ----- #
     # resolve data dir
     if not data_dir:
         data_dir = utils.DATA_DIR
-    # load ncbi database
-    ncbi = NCBITaxonomyDb(data_dir)
+    # load ncbi database, reusing a cached copy if one was already loaded
+    ncbi = get_ncbi_db(data_dir)
     # see if names. if so, convert to taxid
     if utils.sniff_tax_names(df, tax_colname):
         dedup_df[tax_colname] = ncbi.convert_name_to_taxid(dedup_df[tax_colname].tolist())
     else:
-        dedup_df[tax_colname] = [int(x) for x in dedup_df[tax_colname]]
+        # one vectorized cast instead of boxing each taxid through int()
+        dedup_df[tax_colname] = dedup_df[tax_colname].astype(np.int64)
     # filter df to those that tax ids that non-NaN and are present in NCBI database
     is_not_nan = dedup_df[tax_colname].notnull()
-    is_in_db = dedup_df[tax_colname].apply(ncbi.is_in_db)
+    # check membership once per unique taxid instead of applying per row
+    in_db_map = {taxid: ncbi.is_in_db(taxid) for taxid in dedup_df.loc[is_not_nan, tax_colname].unique()}
+    is_in_db = dedup_df[tax_colname].map(in_db_map).fillna(False)
     dedup_df = dedup_df.loc[is_not_nan & is_in_db]
 
-    dedup_df['des_rank'] = dedup_df[tax_colname].apply(lambda x: des_rank_mapper(ft_tar_rank, x, ncbi))
+    # map each unique LCA taxid to the desired rank once, rather than once per row.
+    # taxids repeat heavily across peptides, and the bulk method walks the
+    # taxonomy tree in compiled code instead of querying the database per taxid
+    uniq_taxids = dedup_df[tax_colname].unique()
+    rank_mapping = ncbi.map_ids_to_desired_rank(uniq_taxids, ft_tar_rank)
+    dedup_df['des_rank'] = dedup_df[tax_colname].map(rank_mapping)
     # filter out peptides that are less specific than query rank (which have a taxid of 0)
     dedup_df = dedup_df[dedup_df['des_rank'] > 0]
+    # use integer-backed dtypes for the group keys: categorical GO terms are
+    # hashed to integer codes once, rather than re-hashing the term strings
+    # for every row during factorization, and des_rank fits in int32
+    dedup_df[func_colname] = dedup_df[func_colname].astype('category')
+    dedup_df['des_rank'] = dedup_df['des_rank'].astype(np.int32)
 
     # ---- group by go and new des_rank column, then sum intensity ---- #
-    # select columns for adding purposes
-    df_int = dedup_df[samp_grps.all_intcols + [func_colname, 'des_rank']]
-    # do counts
-    df_counts = df_int.copy()
-    df_counts.loc[:, samp_grps.all_intcols] = df_counts.loc[:, samp_grps.all_intcols] > 0
-    # group by both cog and lca and add
-    grouped = df_int.groupby(by=[func_colname, 'des_rank']).sum()
-    # get groupwise counts (i.e., unique peptides)
-    # multiply by 1 to convert any single booleans (True) to 1
-    counts = df_counts.groupby(by=[func_colname, 'des_rank']).sum() * 1
-    ints_and_counts = grouped.join(counts, rsuffix='_n_peptide')
+    # materialize the intensities once as a contiguous float64 block; the
+    # group keys stay as separate integer code arrays, so no mixed-dtype
+    # intermediate frame is copied out of dedup_df
+    vals = dedup_df[samp_grps.all_intcols].to_numpy(dtype=np.float64)
+    # factorize the two group keys to integer codes and combine them into a
+    # single composite code per observed (GO term, taxon) pair
+    func_codes, func_levels = pd.factorize(dedup_df[func_colname])
+    rank_codes, rank_levels = pd.factorize(dedup_df['des_rank'])
+    composite = func_codes.astype(np.int64) * len(rank_levels) + rank_codes
+    group_codes, group_keys = pd.factorize(composite)
+    # sum intensities within each group with a compiled kernel. groupwise
+    # counts (i.e., unique peptides) are sums of the observed (> 0) indicator
+    grouped_ints = groupby_sum(group_codes, vals, len(group_keys))
+    grouped_npep = groupby_sum(group_codes, (vals > 0).astype(np.float64), len(group_keys))
+    # assemble one flat frame. both kernel outputs share the same group order,
+    # so the count columns attach without an index join, and the group keys
+    # come back as ordinary columns without a MultiIndex/reset_index round trip
+    ints_and_counts = pd.DataFrame(
+        np.hstack((grouped_ints, grouped_npep)),
+        columns=samp_grps.all_intcols + [col + '_n_peptide' for col in samp_grps.all_intcols])
+    ints_and_counts[func_colname] = func_levels[group_keys // len(rank_levels)]
+    ints_and_counts['des_rank'] = rank_levels[group_keys % len(rank_levels)]
 
     # ---- output prep ---- #
     # calculate group means
     results = metaquantome.modules.expand.calc_means(ints_and_counts, samp_grps)
-    # take log of intensities for return
-    results[results == 0] = np.nan
-    results[samp_grps.all_intcols] = np.log2(results[samp_grps.all_intcols])
-    # split the cog/lca index back into 2 columns
-    results.reset_index(inplace=True)
+    # take log of intensities for return. a single fused pass writes the log2
+    # of positive intensities and NaN elsewhere, instead of masking zeros to
+    # NaN first and then taking the log
+    arr = results[samp_grps.all_intcols].to_numpy(dtype=np.float64)
+    logged = np.full_like(arr, np.nan)
+    np.log2(arr, out=logged, where=arr > 0)
+    results[samp_grps.all_intcols] = logged
+    # zero counts and means are also missing
+    other_cols = [col for col in results.columns
+                  if col not in samp_grps.all_intcols and col not in (func_colname, 'des_rank')]
+    results[other_cols] = results[other_cols].where(results[other_cols] != 0)
     # add go description
-    gos = [godb.gofull[x] for x in results[func_colname]]
+    # build the name/namespace lookup table in one pass over the unique terms,
+    # then attach both columns at once with a join
+    uniq_gos = list(results[func_colname].unique())
+    go_names = []
+    go_namespaces = []
+    for go in uniq_gos:
+        term = godb.gofull[go]
+        go_names.append(term.name)
+        go_namespaces.append(term.namespace)
+    go_df = pd.DataFrame({'name': go_names, 'namespace': go_namespaces}, index=uniq_gos)
     results['go_id'] = results[func_colname]
-    results['name'] = [x.name for x in gos]
-    results['namespace'] = [x.namespace for x in gos]
+    results = results.join(go_df, on=func_colname)
     # translate ids back to names
     taxids = results['des_rank']
-    # get ranks
+    # get ranks, with one batched database query for the unique taxids
     results['tax_id'] = taxids
-    results['rank'] = [ncbi.get_rank(int(elem)) for elem in taxids]
+    rank_map = ncbi.get_ranks_bulk(taxids.unique())
+    results['rank'] = taxids.map(rank_map)
     results['taxon_name'] = ncbi.convert_taxid_to_name(taxids)
     # drop des_rank column
     results.drop('des_rank', axis=1, inplace=True)
+    # intern the low-cardinality string columns as categoricals, to cut the
+    # memory held by large result frames. the intensity columns stay float64
+    # because they feed the statistical testing downstream
+    for col in ('rank', 'taxon_name', 'namespace'):
+        results[col] = results[col].astype('category')
     return results
 
 
-def des_rank_mapper(des_rank, taxid, ncbi):
+@njit(parallel=True, cache=True)
+def groupby_sum(group_codes, vals, n_groups):
     """
-    function for mapping a taxid to a desired rank.
-    if des_rank is lower than rank of taxid, 0 is returned (to be filtered out later)
-    :param des_rank:
-    :param taxid:
-    :param ncbi:
-    :return:
+    sum each column of vals within the groups given by group_codes.
+    parallelized over the intensity columns: each thread accumulates into
+    its own output column, so no synchronization is needed
+
+    :param group_codes: 1-D int64 array with the group code for each row of vals
+    :param vals: 2-D float64 array of intensities
+    :param n_groups: total number of groups
+    :return: 2-D float64 array with one row of column sums per group
     """
-    dict_mapper = ncbi.map_id_to_desired_ranks([des_rank], int(taxid))  # todo: fix if taxid is already int
-    if len(dict_mapper) == 1:  # this should always just be 1 or 0, because we're querying with one term
-        return dict_mapper[des_rank]
-    else:
-        return 0
+    nrows, ncols = vals.shape
+    out = np.zeros((n_groups, ncols))
+    for j in prange(ncols):
+        for i in range(nrows):
+            out[group_codes[i], j] += vals[i, j]
+    return out
@@ -1,6 +1,9 @@
+import numpy as np
+import pandas as pd
+
 import metaquantome.modules.expand
 import metaquantome.util.utils
-from metaquantome.databases.GeneOntologyDb import GeneOntologyDb
+from metaquantome.databases.GeneOntologyDb import get_go_db
 from metaquantome.databases.cog import cogCat
 import metaquantome.databases.EnzymeDb as ec
 from metaquantome.util import utils
@@ -42,9 +45,12 @@ def functional_analysis(df, func_colname, samp_grps, ontology, slim_down, data_d
         # use ec database to get term descriptions
         results['description'] = [db.ecdb[term]['descript'] for term in results.index]
     elif ontology == "cog":
+        # the peptide index is not needed for the sum, and the numba engine
+        # requires a numeric index, so drop it before grouping
         cog_sum_df = norm_df[[func_colname] + samp_grps.all_intcols].\
-            groupby(func_colname).\
-            sum()
+            reset_index(drop=True).\
+            groupby(func_colname, sort=False).\
+            agg(_column_sum, engine='numba')
         results = metaquantome.modules.expand.\
             common_hierarchical_analysis('cog', cog_sum_df, func_colname, samp_grps,
                                          hierarchical=False)
@@ -56,6 +62,18 @@ def functional_analysis(df, func_colname, samp_grps, ontology, slim_down, data_d
     return results
 
 
+def _column_sum(values, index):
+    """
+    groupwise column sum, compiled by pandas' numba engine. one fused loop
+    per column replaces the per-column aggregation dispatch of .sum()
+
+    :param values: the values of one column within one group
+    :param index: the group's index (unused, but required by the engine)
+    :return: sum of values
+    """
+    return values.sum()
+
+
 def slim_down_df(godb, df_clean, go_colname):
     """
     Maps GO column to slim GO
@@ -66,14 +84,14 @@ def slim_down_df(godb, df_clean, go_colname):
     """
     # make a local copy, rather than modifying the original df
     df_loc = df_clean.copy()
-    # get a panda Series object of the GO terms
-    func_series = df_loc[go_colname]
-    # convert the Series to a set, for map_set_to_slim
-    func_set = set(func_series)
+    # factorize the GO terms, so the slim mapping is queried once per unique
+    # term and broadcast back by indexing into the mapped-levels array
+    codes, levels = pd.factorize(df_loc[go_colname])
     # returns a dictionary with {<full_go_term>: <slim_go_term>, ... }
-    mapper = godb.map_set_to_slim(func_set)
-    # use map on the Series
-    df_loc.loc[:, go_colname] = func_series.map(mapper)
+    mapper = godb.map_set_to_slim(set(levels))
+    # rows with a missing term have code -1, which picks up the appended NaN
+    slim_levels = np.array([mapper[lvl] for lvl in levels] + [np.nan], dtype=object)
+    df_loc[go_colname] = slim_levels[codes]
     # return copy
     return df_loc
 
@@ -97,7 +115,7 @@ def clean_function_df(data_dir, df, func_colname, ontology, slim_down):
     db = None
     if ontology in {"go", "ec"}:
         if ontology == "go":
-            db = GeneOntologyDb(data_dir, slim_down)
+            db = get_go_db(data_dir, slim_down)
         elif ontology == "ec":
             db = ec.EnzymeDb(data_dir)
         # reduce df to non-redundant functional terms
@@ -1,5 +1,7 @@
+import numpy as np
+
 import metaquantome.modules.expand
-from metaquantome.databases.NCBITaxonomyDb import NCBITaxonomyDb, BASIC_TAXONOMY_TREE
+from metaquantome.databases.NCBITaxonomyDb import get_ncbi_db, BASIC_TAXONOMY_TREE
 from metaquantome.util.utils import filter_df, DATA_DIR, sniff_tax_names
 
 
@@ -16,8 +18,9 @@ def taxonomy_analysis(df, samp_grps, data_dir, tax_colname='lca'):
     # if data_dir is not provided, we define the default
     if not data_dir:
         data_dir = DATA_DIR
-    # load ncbi database from data dir
-    ncbi = NCBITaxonomyDb(data_dir)
+    # load ncbi database from data dir, reusing a cached copy if one was
+    # already loaded
+    ncbi = get_ncbi_db(data_dir)
 
     # check for numeric characters, which indicates taxid
     # if is name, convert to taxid
@@ -25,7 +28,8 @@ def taxonomy_analysis(df, samp_grps, data_dir, tax_colname='lca'):
     if sniff_tax_names(df, tax_colname):
         df[tax_colname] = ncbi.convert_name_to_taxid(df[tax_colname])
     else:
-        df[tax_colname] = [int(x) for x in df[tax_colname]]
+        # one vectorized cast instead of boxing each taxid through int()
+        df[tax_colname] = df[tax_colname].astype(np.int64)
     # filter df to those that tax ids that non-NaN and are present in NCBI database
     df_clean = filter_df(ncbi, tax_colname, df)
     results = metaquantome.modules.expand.common_hierarchical_analysis(ncbi, df_clean, tax_colname, samp_grps)
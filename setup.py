@@ -28,6 +28,7 @@ setup(
         'pandas',
         'ete3',
         'goatools',
+        'numba',
         'numpy',
         'statsmodels',
         'biopython'
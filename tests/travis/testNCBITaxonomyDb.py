@@ -47,6 +47,21 @@ class TestTaxonomyDatabase(unittest.TestCase):
         rank = self.ncbi.get_rank(testid)
         self.assertEqual(rank, 'superkingdom')
 
+    def testMapIdsToDesiredRank(self):
+        # homo is already a genus, homo sapiens maps up to homo, and
+        # bacteria is above genus so it cannot be mapped
+        mapped = self.ncbi.map_ids_to_desired_rank([9605, 9606, 2], 'genus')
+        self.assertEqual(mapped[9605], 9605)
+        self.assertEqual(mapped[9606], 9605)
+        self.assertEqual(mapped[2], 0)
+
+    def testGetRanksBulk(self):
+        # superkingdom bacteria, genus homo, and species homo sapiens, in one query
+        ranks = self.ncbi.get_ranks_bulk([2, 9605, 9606])
+        self.assertEqual(ranks[2], 'superkingdom')
+        self.assertEqual(ranks[9605], 'genus')
+        self.assertEqual(ranks[9606], 'species')
+
     def testGetChildren(self):
         # test case is the family hominidae
         id = 9604